@@ -1,9 +1,12 @@
 import cv2
 import numpy as np
-import pandas as pd
 import os
-import glob
-import math
+import csv
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from plan_utils import MASKS, CANVASES, CORNER_HALVES, load_bgr_hsv, make_scanner, build_manifest
 
 # --- CONFIGURATION ---
 ANGLE_TOLERANCE = 20.0
@@ -24,6 +27,24 @@ L_GREY = np.array([0, 0, 0], dtype=np.uint8);
 U_GREY = np.array([180, 40, 255], dtype=np.uint8)
 
 
+def red_mask(hsv_roi, out):
+    """Red wraps around hue 0/180, so its mask is the union of two hue bands."""
+    cv2.inRange(hsv_roi, L_RED1, U_RED1, dst=out)
+    band2 = cv2.inRange(hsv_roi, L_RED2, U_RED2, dst=MASKS.get(hsv_roi.shape, slot=1))
+    return cv2.bitwise_or(out, band2, dst=out)
+
+
+# Color name -> mask builder, so lookups dispatch on a string instead of comparing bound arrays
+COLOR_FN = {
+    'red': red_mask,
+    'green': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_GREEN, U_GREEN, dst=out),
+    'brown': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_BROWN, U_BROWN, dst=out),
+    'blue': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_BLUE, U_BLUE, dst=out),
+    'grey': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_GREY, U_GREY, dst=out),
+}
+
+
+@functools.lru_cache(maxsize=None)
 def get_corner_point(img_shape, corner_name):
     h, w = img_shape[:2]
     if corner_name == 'c1': return (w, 0)  # Top Right
@@ -33,28 +54,18 @@ def get_corner_point(img_shape, corner_name):
     return (0, 0)
 
 
-def get_corner_bbox(img_shape, corner_name):
-    h, w = img_shape[:2]
-    cx, cy = w // 2, h // 2
-    if corner_name == 'c1': return (cx, 0, w - cx, cy)
-    if corner_name == 'c2': return (cx, cy, w - cx, h - cy)
-    if corner_name == 'c3': return (0, cy, cx, h - cy)
-    if corner_name == 'c4': return (0, 0, cx, cy)
-    return (0, 0, w, h)
+SCAN = {(color, corner): make_scanner(COLOR_FN[color], corner) for color in COLOR_FN for corner in CORNER_HALVES}
 
 
-def get_centroid_in_corner(img, lower, upper, corner_name):
+def get_centroid_in_corner(path, color, corner_name):
+    img, hsv = load_bgr_hsv(path)
     if img is None: return None
 
-    cx, cy, cw, ch = get_corner_bbox(img.shape, corner_name)
-    roi = img[cy:cy + ch, cx:cx + cw]
+    mask, cx, cy = SCAN[(color, corner_name)](hsv)
 
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv, lower, upper)
-    if np.array_equal(lower, L_RED1): mask += cv2.inRange(hsv, L_RED2, U_RED2)
-
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=1)
+    # A contour's area is below its bounding box's, so corners without a large enough patch stop here
+    _, _, bw, bh = cv2.boundingRect(mask)
+    if (bw - 1) * (bh - 1) < MIN_AREA: return None
 
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours: return None
@@ -71,28 +82,26 @@ def get_centroid_in_corner(img, lower, upper, corner_name):
     return None
 
 
-def calculate_angle(p1, p2):
-    dx = p2[0] - p1[0]
-    dy = p2[1] - p1[1]
-    angle = math.degrees(math.atan2(dy, dx))
-    if angle < 0: angle += 180
-    return angle
+def as_point_array(points):
+    """Stacks (x, y) points into an (N, 2) float array; missing points become NaN rows."""
+    return np.array([p if p else (np.nan, np.nan) for p in points], dtype=np.float64).reshape(-1, 2)
 
 
 def check_parallel(p_patch, p_cross, p_ref1, p_ref2):
-    if not p_patch or not p_cross: return 0, 0.0, 0.0, 0.0
-
-    angle_obj = calculate_angle(p_patch, p_cross)
-    angle_ref = calculate_angle(p_ref1, p_ref2)
+    """Vectorized parallelism check over (N, 2) point arrays; returns (scores, diffs, angles_obj, angles_ref)."""
+    angle_obj = np.degrees(np.arctan2(p_cross[:, 1] - p_patch[:, 1], p_cross[:, 0] - p_patch[:, 0])) % 180
+    angle_ref = np.degrees(np.arctan2(p_ref2[:, 1] - p_ref1[:, 1], p_ref2[:, 0] - p_ref1[:, 0])) % 180
 
-    diff = abs(angle_obj - angle_ref)
-    diff = min(diff, 180 - diff)
+    diff = np.abs(angle_obj - angle_ref)
+    diff = np.minimum(diff, 180 - diff)
 
-    return (1 if diff <= ANGLE_TOLERANCE else 0), diff, angle_obj, angle_ref
+    found = ~np.isnan(diff)
+    scores = (found & (diff <= ANGLE_TOLERANCE)).astype(int)
+    return scores, np.where(found, diff, 0.0), angle_obj, angle_ref
 
 
 def draw_visual(img, p_patch, p_cross, p_ref1, p_ref2, score, diff, name):
-    vis = img.copy()
+    vis = CANVASES.get(img)
 
     # Draw Reference Line (Yellow)
     cv2.line(vis, p_ref1, p_ref2, (0, 255, 255), 3)
@@ -111,108 +120,119 @@ def draw_visual(img, p_patch, p_cross, p_ref1, p_ref2, score, diff, name):
     print(f"Generated: {name}")
 
 
-def get_file_info(filename):
-    base = filename.replace('processed_', '')
-    for t in ['ground', 'mid', 'top']:
-        if f'_{t}' in base:
-            parts = base.split(f'_{t}')
-            return parts[0], t
-    return None, None
+def process_set(sid, paths, set_num):
+    """Scores one image set and writes its visualizations (runs in a worker process)."""
+    # Decode the set's images concurrently (imread releases the GIL), warming the load_bgr_hsv cache
+    present = {t: p for t, p in paths.items() if p}
+    with ThreadPoolExecutor(max_workers=len(present) or 1) as io_pool:
+        loaded = dict(zip(present, io_pool.map(load_bgr_hsv, present.values())))
+    imgs = {t: loaded[t][0] if t in loaded else None for t in paths}
+
+    # We need at least ground OR top to do something, but optimally both for full row
+    if not (imgs['ground'] is not None or imgs['top'] is not None):
+        return None
+
+    # We need image dimensions. Use whichever image is available.
+    ref_img = imgs['ground'] if imgs['ground'] is not None else imgs['top']
+    c1, c2, c3, c4 = (get_corner_point(ref_img.shape, c) for c in ('c1', 'c2', 'c3', 'c4'))
+
+    row = {'Set': sid, 'H12': 0, 'H56': 0, 'M12': 0, 'M56': 0}
+    checks = []  # (score name, plan, patch point, cross point, reference corner 1, reference corner 2)
+
+    # --- LOGIC ---
+    if set_num in [0, 1]:
+        # H12: Ground Image -> Green(c2) vs Red(c1) || C1-C2
+        if imgs['ground'] is not None:
+            p_green = get_centroid_in_corner(paths['ground'], 'green', 'c2')
+            p_red = get_centroid_in_corner(paths['ground'], 'red', 'c1')
+
+            checks.append(('H12', 'ground', p_green, p_red, c1, c2))
+
+        # H56: Top Image -> Brown(c3/c4) vs Red(c3/c4) || C3-C4
+        # Prompt says: Brown near C4 or C3, Cross near C3 or C4.
+        # Let's assume Cross is at C3 and Brown at C4 for 0/1 based on visual logic, or try both?
+        # Standard layout usually opposes them. Let's look for Brown in C3/C4 and Red in C3/C4.
+        if imgs['top'] is not None:
+            # Try finding brown in C4, Red in C3 (common pattern)
+            p_brown = get_centroid_in_corner(paths['top'], 'brown', 'c4')
+            p_red = get_centroid_in_corner(paths['top'], 'red', 'c3')
+
+            # Fallback: Brown in C3, Red in C4
+            if p_brown is None:
+                p_brown = get_centroid_in_corner(paths['top'], 'brown', 'c3')
+            if p_red is None:
+                p_red = get_centroid_in_corner(paths['top'], 'red', 'c4')
+
+            checks.append(('H56', 'top', p_brown, p_red, c3, c4))
+
+    elif set_num in [2, 3]:
+        # M12: Ground Image -> Blue(c4) vs Red(c3) || C3-C4
+        if imgs['ground'] is not None:
+            p_blue = get_centroid_in_corner(paths['ground'], 'blue', 'c4')
+            p_red = get_centroid_in_corner(paths['ground'], 'red', 'c3')
+
+            checks.append(('M12', 'ground', p_blue, p_red, c3, c4))
+
+        # M56: Top Image -> Grey(c1/c2) vs Red(c2/c1) || C1-C2
+        if imgs['top'] is not None:
+            p_grey = get_centroid_in_corner(paths['top'], 'grey', 'c1')
+            p_red = get_centroid_in_corner(paths['top'], 'red', 'c2')
+
+            if p_grey is None: p_grey = get_centroid_in_corner(paths['top'], 'grey', 'c2')
+            if p_red is None: p_red = get_centroid_in_corner(paths['top'], 'red', 'c1')
+
+            checks.append(('M56', 'top', p_grey, p_red, c1, c2))
+
+    if checks:
+        # Score all of the set's checks in one vectorized pass
+        names, plans, patches, crosses, refs1, refs2 = zip(*checks)
+        scores, diffs, _, _ = check_parallel(as_point_array(patches), as_point_array(crosses),
+                                             as_point_array(refs1), as_point_array(refs2))
+        for i, name in enumerate(names):
+            row[name] = int(scores[i])
+            draw_visual(imgs[plans[i]], patches[i], crosses[i], refs1[i], refs2[i], row[name], diffs[i],
+                        f"parallel_{sid}_{name}.png")
+
+    return row
 
 
 def run_analysis(folder_path):
-    files = sorted(glob.glob(os.path.join(folder_path, "*.*")))
-    files = [f for f in files if f.lower().endswith(('.png', '.jpg'))]
-
-    groups = {}
-    for f in files:
-        sid, ftype = get_file_info(os.path.basename(f))
-        if sid and ftype != 'mid':  # Ignore mid images
-            if sid not in groups: groups[sid] = {'ground': None, 'top': None}
-            groups[sid][ftype] = cv2.imread(f)
-
-    results = []
-    for sid, imgs in groups.items():
-        # We need at least ground OR top to do something, but optimally both for full row
-        if not (imgs['ground'] is not None or imgs['top'] is not None):
-            continue
-
-        # We need image dimensions. Use whichever image is available.
-        ref_img = imgs['ground'] if imgs['ground'] is not None else imgs['top']
-        h, w = ref_img.shape[:2]
-        c1 = (w, 0);
-        c2 = (w, h);
-        c3 = (0, h);
-        c4 = (0, 0)
-
-        try:
-            set_num = int(sid.split('_')[-1])
-        except:
-            continue
-
-        row = {'Set': sid, 'H12': 0, 'H56': 0, 'M12': 0, 'M56': 0}
-
-        # --- LOGIC ---
-        if set_num in [0, 1]:
-            # H12: Ground Image -> Green(c2) vs Red(c1) || C1-C2
-            if imgs['ground'] is not None:
-                p_green = get_centroid_in_corner(imgs['ground'], L_GREEN, U_GREEN, 'c2')
-                p_red = get_centroid_in_corner(imgs['ground'], L_RED1, U_RED1, 'c1')
-
-                row['H12'], diff, _, _ = check_parallel(p_green, p_red, c1, c2)
-                draw_visual(imgs['ground'], p_green, p_red, c1, c2, row['H12'], diff, f"parallel_{sid}_H12.png")
-
-            # H56: Top Image -> Brown(c3/c4) vs Red(c3/c4) || C3-C4
-            # Prompt says: Brown near C4 or C3, Cross near C3 or C4.
-            # Let's assume Cross is at C3 and Brown at C4 for 0/1 based on visual logic, or try both?
-            # Standard layout usually opposes them. Let's look for Brown in C3/C4 and Red in C3/C4.
-            if imgs['top'] is not None:
-                # Try finding brown in C4, Red in C3 (common pattern)
-                p_brown = get_centroid_in_corner(imgs['top'], L_BROWN, U_BROWN, 'c4')
-                p_red = get_centroid_in_corner(imgs['top'], L_RED1, U_RED1, 'c3')
-
-                # Fallback: Brown in C3, Red in C4
-                if p_brown is None:
-                    p_brown = get_centroid_in_corner(imgs['top'], L_BROWN, U_BROWN, 'c3')
-                if p_red is None:
-                    p_red = get_centroid_in_corner(imgs['top'], L_RED1, U_RED1, 'c4')
-
-                row['H56'], diff, _, _ = check_parallel(p_brown, p_red, c3, c4)
-                draw_visual(imgs['top'], p_brown, p_red, c3, c4, row['H56'], diff, f"parallel_{sid}_H56.png")
-
-        elif set_num in [2, 3]:
-            # M12: Ground Image -> Blue(c4) vs Red(c3) || C3-C4
-            if imgs['ground'] is not None:
-                p_blue = get_centroid_in_corner(imgs['ground'], L_BLUE, U_BLUE, 'c4')
-                p_red = get_centroid_in_corner(imgs['ground'], L_RED1, U_RED1, 'c3')
-
-                row['M12'], diff, _, _ = check_parallel(p_blue, p_red, c3, c4)
-                draw_visual(imgs['ground'], p_blue, p_red, c3, c4, row['M12'], diff, f"parallel_{sid}_M12.png")
-
-            # M56: Top Image -> Grey(c1/c2) vs Red(c2/c1) || C1-C2
-            if imgs['top'] is not None:
-                p_grey = get_centroid_in_corner(imgs['top'], L_GREY, U_GREY, 'c1')
-                p_red = get_centroid_in_corner(imgs['top'], L_RED1, U_RED1, 'c2')
-
-                if p_grey is None: p_grey = get_centroid_in_corner(imgs['top'], L_GREY, U_GREY, 'c2')
-                if p_red is None: p_red = get_centroid_in_corner(imgs['top'], L_RED1, U_RED1, 'c1')
-
-                row['M56'], diff, _, _ = check_parallel(p_grey, p_red, c1, c2)
-                draw_visual(imgs['top'], p_grey, p_red, c1, c2, row['M56'], diff, f"parallel_{sid}_M56.png")
-
-        results.append(row)
-        print(f"{sid}: {row}")
+    manifest = build_manifest(folder_path)
+
+    # One spawn worker per set ('spawn' avoids OpenCV's fork hangs), each capped to one OpenCV thread
+    rows = {}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=ctx,
+                             initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        futures = {}
+        for sid, entry in manifest.items():
+            # Mid plans are not used by this analysis
+            if entry['set_num'] is None or not (entry['ground'] or entry['top']):
+                continue
+            paths = {'ground': entry['ground'], 'top': entry['top']}
+            futures[executor.submit(process_set, sid, paths, entry['set_num'])] = sid
+
+        for future in as_completed(futures):
+            sid, row = futures[future], future.result()
+            if row is None: continue
+            rows[sid] = row
+            print(f"{sid}: {row}")
+
+    # Keep the folder order in the report regardless of completion order
+    results = [rows[sid] for sid in manifest if sid in rows]
 
     if results:
-        df = pd.DataFrame(results)
-        cols = ['H12', 'H56', 'M12', 'M56']
-        for c in cols:
-            if c not in df.columns: df[c] = 0
+        header = ['Set', 'H12', 'H56', 'M12', 'M56']
+        table = [header] + [[r.get(c, 0) for c in header] for r in results]
 
         csv_path = "parallelism_ground_top.csv"
-        df.to_csv(csv_path, index=False)
+        with open(csv_path, "w", newline="") as f:
+            csv.writer(f, lineterminator="\n").writerows(table)
         print(f"\nSaved results to {csv_path}")
-        print(df[['Set'] + cols].to_string(index=False))
+
+        widths = [max(len(str(line[i])) for line in table) for i in range(len(header))]
+        for line in table:
+            print('  '.join(str(v).rjust(n) for v, n in zip(line, widths)))
 
 
 if __name__ == "__main__":
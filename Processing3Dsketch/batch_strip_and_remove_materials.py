@@ -13,12 +13,40 @@ Examples:
 """
 
 import argparse
+import contextlib
+import os
+import re
 import sys
 from pathlib import Path
-import re
-
-FACE_RE = re.compile(r'^f\s+(.+)$', re.IGNORECASE)
-USEMTL_RE = re.compile(r'^usemtl\s+(.+)$', re.IGNORECASE)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+READ_BUFFER = 1 << 20  # OBJ files are streamed line by line through a 1 MiB read buffer
+
+def statement_payload(line, n):
+    # Payload of an OBJ statement whose n-char keyword already matched: like '^kw\s+(.+)$',
+    # the keyword must be followed by whitespace and at least one more character.
+    end = len(line) - 1 if line.endswith('\n') else len(line)
+    if end - n < 2 or not line[n].isspace():
+        return None
+    return line[n + 1:end]
+
+# Faces are parsed in blocks of up to FACE_BLOCK. A block made only of 'v/vt/vn' triangles
+# is parsed with one NumPy call; any other block goes through parse_face_tokens.
+FACE_BLOCK = 65536
+_IDX = r'[0-9]{1,18}'
+_CORNER = f'{_IDX}/{_IDX}/{_IDX}'
+TRIANGLE_FMT = "f %d/%d/%d %d/%d/%d %d/%d/%d\n"
+TRIANGLE_BLOCK_RE = re.compile(rf'(?:[ \t]*{_CORNER}[ \t]+{_CORNER}[ \t]+{_CORNER}[ \t]*\n)*')
+
+def parse_triangle_block(payloads):
+    # Returns the block's indices as an (F, 3, 3) array [face, corner, v/vt/vn], or None if
+    # any face in it is not a plain 'v/vt/vn' triangle.
+    text = "\n".join(payloads) + "\n"
+    if not TRIANGLE_BLOCK_RE.fullmatch(text):
+        return None
+    return np.fromstring(text.replace('/', ' '), sep=' ', dtype=np.int64).reshape(-1, 3, 3)
 
 def parse_face_tokens(face_payload):
     verts = []
@@ -43,151 +71,224 @@ def rebuild_face_tokens(verts):
             parts.append(f"{v}/{vt}/{vn}")
     return "f " + " ".join(parts)
 
-def scan_negative_indices(lines):
-    for line in lines:
-        m = FACE_RE.match(line)
-        if not m:
-            continue
-        payload = m.group(1)
-        for part in payload.split():
-            v = part.split('/')[0]
-            try:
-                if int(v) < 0:
-                    return True
-            except Exception:
-                pass
+def has_negative_vertex(face_payload):
+    for part in face_payload.split():
+        v = part.split('/')[0]
+        try:
+            if int(v) < 0:
+                return True
+        except Exception:
+            pass
     return False
 
+def classify_lines(input_path, is_remove_material):
+    # Streams the OBJ and yields (line, face, removed) per line: face is the face payload (None for
+    # any other statement) and removed tells whether that face uses a material being stripped.
+
+    # The material only changes on 'usemtl' lines, so its removal test is cached there
+    current_removed = is_remove_material(None)
+    with open(input_path, "r", encoding="utf-8", errors="ignore", buffering=READ_BUFFER) as f:
+        for line in f:
+            # Dispatch on the first character; only 'usemtl' and face statements need parsing
+            head = line[:1]
+            if head in ('u', 'U') and line[:6].lower() == 'usemtl':
+                name = statement_payload(line, 6)
+                if name is not None:
+                    current_removed = is_remove_material(name.strip())
+                    yield line, None, False
+                    continue
+
+            face = statement_payload(line, 1) if head in ('f', 'F') else None
+            yield line, face, face is not None and current_removed
+
+@contextlib.contextmanager
+def atomic_output(output_path):
+    # Write to a temp file and move it over output_path when done: safe when output == input, no partial files
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            yield out
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.unlink(tmp_path)
+        raise
+
+def copy_without_removed(input_path, output_path, is_remove_material):
+    # One streaming pass: copy every line except the removed faces
+    removed_faces = 0
+    kept_faces = 0
+    with atomic_output(output_path) as out:
+        for line, face, removed in classify_lines(input_path, is_remove_material):
+            if removed:
+                removed_faces += 1
+                continue
+            if face is not None:
+                kept_faces += 1
+            out.write(line)
+    return {"removed_faces": removed_faces, "kept_faces": kept_faces, "compaction": False}
+
 def strip_obj_material(input_path, output_path, remove_materials, case_sensitive=False, compact=False):
     remove_set = set(remove_materials if case_sensitive else [s.lower() for s in remove_materials])
 
-    with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.readlines()
-
-    current_mtl = None
-    kept_lines = []
     removed_faces = 0
     kept_faces = 0
 
-    do_compact = compact and not scan_negative_indices(lines)
-    used_v = set()
-    used_vt = set()
-    used_vn = set()
-
     def is_remove_material(name):
         if name is None:
             return False
         return (name if case_sensitive else name.lower()) in remove_set
 
-    for line in lines:
-        um = USEMTL_RE.match(line)
-        if um:
-            current_mtl = um.group(1).strip()
-            kept_lines.append(line)
-            continue
-
-        fm = FACE_RE.match(line)
-        if fm:
-            if is_remove_material(current_mtl):
-                removed_faces += 1
-                continue
-            else:
-                kept_faces += 1
-                if do_compact:
-                    verts = parse_face_tokens(fm.group(1))
-                    for v, vt, vn in verts:
-                        if v is not None and v > 0:
-                            used_v.add(v)
-                        if vt is not None and vt > 0:
-                            used_vt.add(vt)
-                        if vn is not None and vn > 0:
-                            used_vn.add(vn)
-                    kept_lines.append(("__FACE__", verts))
-                else:
-                    kept_lines.append(line)
-            continue
-
-        kept_lines.append(line)
-
-    if not do_compact:
-        with open(output_path, "w", encoding="utf-8") as out:
-            for item in kept_lines:
-                if isinstance(item, tuple) and item and item[0] == "__FACE__":
-                    out.write(rebuild_face_tokens(item[1]) + "\n")
-                else:
-                    out.write(item)
-        return {"removed_faces": removed_faces, "kept_faces": kept_faces, "compaction": False}
+    if not compact:
+        return copy_without_removed(input_path, output_path, is_remove_material)
 
+    # Pass 1: collect the vertex data and the indices the kept faces use. Only the v/vt/vn
+    # lines are held in memory; everything else is re-read in pass 2.
     v_lines = []
     vt_lines = []
     vn_lines = []
-    other_lines = []
-
-    for item in kept_lines:
-        if isinstance(item, str):
-            if item.startswith('v '):
-                v_lines.append(item)
-            elif item.startswith('vt '):
-                vt_lines.append(item)
-            elif item.startswith('vn '):
-                vn_lines.append(item)
-            else:
-                other_lines.append(item)
-        else:
-            other_lines.append(item)
-
-    def build_remap(used_set, total_count):
-        used_sorted = sorted([i for i in used_set if 1 <= i <= total_count])
-        remap = {}
-        for new_idx, old_idx in enumerate(used_sorted, start=1):
-            remap[old_idx] = new_idx
-        return remap, used_sorted
-
-    v_remap, used_v_sorted = build_remap(used_v, len(v_lines))
-    vt_remap, used_vt_sorted = build_remap(used_vt, len(vt_lines))
-    vn_remap, used_vn_sorted = build_remap(used_vn, len(vn_lines))
-
-    new_v_lines = [v_lines[i-1] for i in used_v_sorted]
-    new_vt_lines = [vt_lines[i-1] for i in used_vt_sorted]
-    new_vn_lines = [vn_lines[i-1] for i in used_vn_sorted]
-
-    with open(output_path, "w", encoding="utf-8") as out:
+    used_v = []
+    used_vt = []
+    used_vn = []
+
+    def collect_used(payloads):
+        block = parse_triangle_block(payloads)
+        if block is not None:
+            for used, idx in zip((used_v, used_vt, used_vn), block.reshape(-1, 3).T):
+                used.append(np.unique(idx[idx > 0]))
+            return
+
+        found_v, found_vt, found_vn = set(), set(), set()
+        for payload in payloads:
+            for v, vt, vn in parse_face_tokens(payload):
+                if v is not None and v > 0:
+                    found_v.add(v)
+                if vt is not None and vt > 0:
+                    found_vt.add(vt)
+                if vn is not None and vn > 0:
+                    found_vn.add(vn)
+        for used, found in zip((used_v, used_vt, used_vn), (found_v, found_vt, found_vn)):
+            used.append(np.fromiter(found, dtype=np.int64, count=len(found)))
+
+    # A malformed face only matters once the file is known to be compactable, so a parse
+    # error is held back until the whole file has been checked for negative indices
+    parse_error = None
+
+    def collect_used_deferred(payloads):
+        nonlocal parse_error
+        if parse_error is None:
+            try:
+                collect_used(payloads)
+            except ValueError as e:
+                parse_error = e
+
+    kept_payloads = []
+    for line, face, removed in classify_lines(input_path, is_remove_material):
+        if face is not None:
+            # Negative (relative) vertex indices can't be compacted: fall back to a plain copy
+            if '-' in face and has_negative_vertex(face):
+                return copy_without_removed(input_path, output_path, is_remove_material)
+            if removed:
+                removed_faces += 1
+                continue
+            kept_faces += 1
+            kept_payloads.append(face)
+            if len(kept_payloads) >= FACE_BLOCK:
+                collect_used_deferred(kept_payloads)
+                kept_payloads.clear()
+        elif line.startswith('v '):
+            v_lines.append(line)
+        elif line.startswith('vt '):
+            vt_lines.append(line)
+        elif line.startswith('vn '):
+            vn_lines.append(line)
+    collect_used_deferred(kept_payloads)
+    if parse_error is not None:
+        raise parse_error
+
+    def build_remap(used_parts, total_count):
+        # Lookup table from old to new index (0 = not kept) and the kept old indices in order
+        used_sorted = np.unique(np.concatenate(used_parts))
+        used_sorted = used_sorted[used_sorted <= total_count]
+        lut = np.zeros(total_count + 1, dtype=np.int64)
+        lut[used_sorted] = np.arange(1, len(used_sorted) + 1)
+        return lut, used_sorted
+
+    v_lut, used_v_sorted = build_remap(used_v, len(v_lines))
+    vt_lut, used_vt_sorted = build_remap(used_vt, len(vt_lines))
+    vn_lut, used_vn_sorted = build_remap(used_vn, len(vn_lines))
+
+    new_v_lines = [v_lines[i-1] for i in used_v_sorted.tolist()]
+    new_vt_lines = [vt_lines[i-1] for i in used_vt_sorted.tolist()]
+    new_vn_lines = [vn_lines[i-1] for i in used_vn_sorted.tolist()]
+
+    def lookup(lut, idx):
+        # Remaps positive indices through lut; also returns the mask of those that have no new index
+        new = np.where(idx > 0, lut[np.where(idx < len(lut), idx, 0)], idx)
+        return new, (idx > 0) & (new == 0)
+
+    v_map, vt_map, vn_map = v_lut.tolist(), vt_lut.tolist(), vn_lut.tolist()
+
+    def lookup_one(lut_list, i):
+        if i is None or i <= 0:
+            return i
+        return (lut_list[i] or None) if i < len(lut_list) else None
+
+    def remap_faces(payloads):
+        block = parse_triangle_block(payloads)
+        if block is not None:
+            (v, v_missing), (vt, vt_missing), (vn, vn_missing) = (
+                lookup(lut, block[:, :, k]) for k, lut in enumerate((v_lut, vt_lut, vn_lut)))
+            # A dangling vt/vn changes the face's token layout, so such blocks take the slow path
+            if not (vt_missing.any() or vn_missing.any()):
+                faces = np.stack((v, vt, vn), axis=2)[~v_missing.any(axis=1)].reshape(-1, 9)
+                return [TRIANGLE_FMT % tuple(f) for f in faces.tolist()]
+
+        lines = []
+        for payload in payloads:
+            remapped = []
+            for v, vt, vn in parse_face_tokens(payload):
+                rv = lookup_one(v_map, v)
+                if rv is None:
+                    remapped = None
+                    break
+                remapped.append((rv, lookup_one(vt_map, vt), lookup_one(vn_map, vn)))
+            if remapped is not None:
+                lines.append(rebuild_face_tokens(remapped) + "\n")
+        return lines
+
+    # Pass 2: re-read the file and emit it with the vertex data compacted and the faces reindexed.
+    # Runs of consecutive kept faces are remapped a block at a time.
+    with atomic_output(output_path) as out:
+        run = []
         emitted_v = emitted_vt = emitted_vn = False
-        for item in kept_lines:
-            if isinstance(item, str):
-                if item.startswith('v '):
-                    if not emitted_v:
-                        for ln in new_v_lines:
-                            out.write(ln)
-                        emitted_v = True
-                    continue
-                elif item.startswith('vt '):
-                    if not emitted_vt:
-                        for ln in new_vt_lines:
-                            out.write(ln)
-                        emitted_vt = True
-                    continue
-                elif item.startswith('vn '):
-                    if not emitted_vn:
-                        for ln in new_vn_lines:
-                            out.write(ln)
-                        emitted_vn = True
-                    continue
-                else:
-                    out.write(item)
+        for line, face, removed in classify_lines(input_path, is_remove_material):
+            if face is not None:
+                if not removed:
+                    run.append(face)
+                    if len(run) >= FACE_BLOCK:
+                        out.writelines(remap_faces(run))
+                        run.clear()
+                continue
+
+            if run:
+                out.writelines(remap_faces(run))
+                run.clear()
+
+            if line.startswith('v '):
+                if not emitted_v:
+                    out.writelines(new_v_lines)
+                    emitted_v = True
+            elif line.startswith('vt '):
+                if not emitted_vt:
+                    out.writelines(new_vt_lines)
+                    emitted_vt = True
+            elif line.startswith('vn '):
+                if not emitted_vn:
+                    out.writelines(new_vn_lines)
+                    emitted_vn = True
             else:
-                _, verts = item
-                remapped = []
-                for v, vt, vn in verts:
-                    rv = v_remap.get(v, None) if (v is not None and v > 0) else v
-                    rvt = vt_remap.get(vt, None) if (vt is not None and vt > 0) else vt
-                    rvn = vn_remap.get(vn, None) if (vn is not None and vn > 0) else vn
-                    if rv is None:
-                        remapped = None
-                        break
-                    remapped.append((rv, rvt, rvn))
-                if remapped is not None:
-                    out.write(rebuild_face_tokens(remapped) + "\n")
+                out.write(line)
+        out.writelines(remap_faces(run))
 
     return {
         "removed_faces": removed_faces,
@@ -236,32 +337,42 @@ def run_batch(args):
     skipped = 0
     failed = 0
 
-    for i, f in enumerate(files, 1):
-        rel = f.relative_to(in_dir)
-        if out_dir:
-            out_path = (out_dir / rel).with_suffix(".obj")
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-        else:
-            out_path = f.with_name(f.stem + args.suffix + ".obj")
+    # Files are independent, so they are stripped in parallel worker processes;
+    # all progress output stays in this process so lines don't interleave.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {}
+        for i, f in enumerate(files, 1):
+            rel = f.relative_to(in_dir)
+            if out_dir:
+                out_path = (out_dir / rel).with_suffix(".obj")
+                out_path.parent.mkdir(parents=True, exist_ok=True)
+            else:
+                out_path = f.with_name(f.stem + args.suffix + ".obj")
 
-        if out_path.exists() and not args.overwrite:
-            print(f"[SKIP] ({i}/{total}) {rel} -> {out_path} (exists)")
-            skipped += 1
-            continue
+            if out_path.exists() and not args.overwrite:
+                print(f"[SKIP] ({i}/{total}) {rel} -> {out_path} (exists)")
+                skipped += 1
+                continue
 
-        try:
-            stats = strip_obj_material(
+            future = executor.submit(
+                strip_obj_material,
                 input_path=str(f),
                 output_path=str(out_path),
                 remove_materials=args.remove,
                 case_sensitive=args.case_sensitive,
                 compact=args.compact,
             )
-            print(f"[ OK ] ({i}/{total}) {rel} -> {out_path.name} | removed={stats['removed_faces']} kept={stats['kept_faces']} compact={'y' if stats['compaction'] else 'n'}")
-            ok += 1
-        except Exception as e:
-            print(f"[FAIL] ({i}/{total}) {rel} -> {e}", file=sys.stderr)
-            failed += 1
+            futures[future] = (i, rel, out_path)
+
+        for future in as_completed(futures):
+            i, rel, out_path = futures[future]
+            try:
+                stats = future.result()
+                print(f"[ OK ] ({i}/{total}) {rel} -> {out_path.name} | removed={stats['removed_faces']} kept={stats['kept_faces']} compact={'y' if stats['compaction'] else 'n'}")
+                ok += 1
+            except Exception as e:
+                print(f"[FAIL] ({i}/{total}) {rel} -> {e}", file=sys.stderr)
+                failed += 1
 
     print("\n=== Summary ===")
     print(f"Found:    {total}")
@@ -1,7 +1,10 @@
 import cv2
 import numpy as np
 import os
-import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from plan_utils import MASKS, CANVASES, CORNER_HALVES, load_bgr_hsv, make_scanner, build_manifest
 
 # --- CONFIGURATION AND COLOR DEFINITIONS ---
 
@@ -34,74 +37,64 @@ INTERSECTION_COLOR = (0, 165, 255)  # Orange for intersection box
 
 # --- UTILITY FUNCTIONS ---
 
-def get_corner_bbox(img_shape, corner_name):
-    """Returns (x, y, w, h) for the specific quadrant."""
-    h, w = img_shape[:2]
-    cx, cy = w // 2, h // 2
-
-    if corner_name == 'c1': return (cx, 0, w - cx, cy)
-    if corner_name == 'c2': return (cx, cy, w - cx, h - cy)
-    if corner_name == 'c3': return (0, cy, cx, h - cy)
-    if corner_name == 'c4': return (0, 0, cx, cy)
-    return (0, 0, w, h)
-
+def red_mask(hsv_roi, out):
+    """Red wraps around hue 0/180, so its mask is the union of two hue bands."""
+    cv2.inRange(hsv_roi, L_RED1, U_RED1, dst=out)
+    band2 = cv2.inRange(hsv_roi, L_RED2, U_RED2, dst=MASKS.get(hsv_roi.shape, slot=1))
+    return cv2.bitwise_or(out, band2, dst=out)
 
-def find_color_in_corner(img, lower, upper, corner_name):
-    """Finds bounding box of the largest color patch inside the specified corner quadrant."""
-    if img is None: return None
 
-    cx, cy, cw, ch = get_corner_bbox(img.shape, corner_name)
-    roi = img[cy:cy + ch, cx:cx + cw]
+# Color name -> mask builder, so lookups dispatch on a string instead of comparing bound arrays
+COLOR_FN = {
+    'red': red_mask,
+    'green': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_GREEN, U_GREEN, dst=out),
+    'brown': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_BROWN, U_BROWN, dst=out),
+    'blue': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_BLUE, U_BLUE, dst=out),
+    'grey': lambda hsv_roi, out: cv2.inRange(hsv_roi, L_GREY, U_GREY, dst=out),
+}
 
-    hsv_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv_roi, lower, upper)
 
-    if np.array_equal(lower, L_RED1): mask += cv2.inRange(hsv_roi, L_RED2, U_RED2)
+SCAN = {(color, corner): make_scanner(COLOR_FN[color], corner) for color in COLOR_FN for corner in CORNER_HALVES}
 
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.dilate(mask, kernel, iterations=1)
 
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def find_color_in_corner(path, color, corner_name):
+    """Finds bounding box of the largest color patch inside the specified corner quadrant."""
+    img, hsv = load_bgr_hsv(path)
+    if img is None: return None
 
-    largest_bbox = None;
-    max_area = 0
+    mask, cx, cy = SCAN[(color, corner_name)](hsv)
 
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > max_area and area > MIN_AREA:
-            max_area = area
-            # --- CRITICAL CHANGE: Use TIGHT bounding box around CONTOUR ---
-            rx, ry, rw, rh = cv2.boundingRect(cnt)
-            largest_bbox = (cx + rx, cy + ry, rw, rh)
+    # A contour's area is below its bounding box's, so corners without a large enough patch stop here
+    _, _, bw, bh = cv2.boundingRect(mask)
+    if (bw - 1) * (bh - 1) <= MIN_AREA: return None
 
-    return largest_bbox
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours: return None
 
+    # --- CRITICAL CHANGE: Use TIGHT bounding box around CONTOUR ---
+    largest = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(largest) <= MIN_AREA: return None
+    rx, ry, rw, rh = cv2.boundingRect(largest)
+    return (cx + rx, cy + ry, rw, rh)
 
-def check_overlap(bbox1, bbox2):
-    """Checks if two bounding boxes overlap."""
-    if bbox1 is None or bbox2 is None: return 0
-    x1, y1, w1, h1 = bbox1;
-    x2, y2, w2, h2 = bbox2
 
-    overlap_w = min(x1 + w1, x2 + w2) - max(x1, x2)
-    overlap_h = min(y1 + h1, y2 + h2) - max(y1, y2)
+def as_box_array(boxes):
+    """Stacks (x, y, w, h) boxes into an (N, 4) int array; missing boxes become rows of -1."""
+    return np.array([b if b else (-1, -1, -1, -1) for b in boxes], dtype=np.int32).reshape(-1, 4)
 
-    return 1 if overlap_w > 0 and overlap_h > 0 else 0
 
+def check_overlap(boxes1, boxes2):
+    """Vectorized overlap check over (N, 4) box arrays; missing boxes (-1 rows) score 0."""
+    overlap_w = np.minimum(boxes1[:, 0] + boxes1[:, 2], boxes2[:, 0] + boxes2[:, 2]) - np.maximum(boxes1[:, 0], boxes2[:, 0])
+    overlap_h = np.minimum(boxes1[:, 1] + boxes1[:, 3], boxes2[:, 1] + boxes2[:, 3]) - np.maximum(boxes1[:, 1], boxes2[:, 1])
 
-def get_file_set_info(filename):
-    """Parses filename to get set_id and plan_type, handling 'processed_' prefix."""
-    base = filename.replace('processed_', '')
-    for t in ['ground', 'mid', 'top']:
-        if f'_{t}' in base:
-            parts = base.split(f'_{t}')
-            return parts[0], t
-    return None, None
+    found = (boxes1[:, 0] >= 0) & (boxes2[:, 0] >= 0)
+    return (found & (overlap_w > 0) & (overlap_h > 0)).astype(int)
 
 
 def calculate_overlap_center(bbox1, bbox2):
     """Calculates the center point of the overlap region."""
-    if check_overlap(bbox1, bbox2) == 0: return None
+    if bbox1 is None or bbox2 is None: return None
 
     x1, y1, w1, h1 = bbox1
     x2, y2, w2, h2 = bbox2
@@ -111,6 +104,7 @@ def calculate_overlap_center(bbox1, bbox2):
     intersect_y_start = max(y1, y2)
     intersect_x_end = min(x1 + w1, x2 + w2)
     intersect_y_end = min(y1 + h1, y2 + h2)
+    if intersect_x_end <= intersect_x_start or intersect_y_end <= intersect_y_start: return None
 
     # Calculate the center of the intersection rectangle
     center_x = (intersect_x_start + intersect_x_end) // 2
@@ -124,11 +118,10 @@ def calculate_overlap_center(bbox1, bbox2):
     return center_x, center_y, intersection_bbox
 
 
-def create_pure_overlap_visualization(base_img, overlay_bbox, target_bbox, corner_name, source_type, score_name,
-                                      output_filename):
+def create_pure_overlap_visualization(base_img, overlay_bbox, target_bbox, score_value, corner_name, source_type,
+                                      score_name, output_filename):
     """Generates a visualization showing only the BBoxes, the overlap point, and the intersection box."""
-    img = base_img.copy()
-    score_value = check_overlap(overlay_bbox, target_bbox)
+    img = CANVASES.get(base_img)
 
     # Draw the Red Cross BBox (Target) - Cyan
     if target_bbox:
@@ -157,7 +150,6 @@ def create_pure_overlap_visualization(base_img, overlay_bbox, target_bbox, corne
 
     cv2.imwrite(output_filename, img)
     print(f"   -> Generated {output_filename} (Score: {score_value})")
-    return img
 
 
 # --- MAIN LOGIC ---
@@ -165,15 +157,16 @@ def create_pure_overlap_visualization(base_img, overlay_bbox, target_bbox, corne
 def visualize_and_confirm_set_logic(sid, paths, set_num):
     """Runs the two primary checks for a specific set ID and generates verification images."""
 
-    mid_img = cv2.imread(paths['mid']);
-    ground_img = cv2.imread(paths['ground']);
-    top_img = cv2.imread(paths['top'])
-    if mid_img is None or ground_img is None or top_img is None: return
+    # Decode the set's images concurrently (imread releases the GIL), warming the load_bgr_hsv cache
+    with ThreadPoolExecutor(max_workers=3) as io_pool:
+        (mid_img, _), (ground_img, _), (top_img, _) = io_pool.map(
+            load_bgr_hsv, (paths['mid'], paths['ground'], paths['top']))
+    if mid_img is None or ground_img is None or top_img is None: return None
 
     # --- DETERMINE LOGIC & COLORS ---
     if set_num in [0, 1]:
-        ground_color_L, ground_color_U = L_GREEN, U_GREEN
-        top_color_L, top_color_U = L_BROWN, U_BROWN
+        ground_color = 'green'
+        top_color = 'brown'
         score_name_1, score_name_2 = 'H1H4', 'H3H6'
 
         if set_num == 0:
@@ -184,8 +177,8 @@ def visualize_and_confirm_set_logic(sid, paths, set_num):
         top_source = "Brown Patch (TOP)"
 
     elif set_num in [2, 3]:
-        ground_color_L, ground_color_U = L_BLUE, U_BLUE
-        top_color_L, top_color_U = L_GREY, U_GREY
+        ground_color = 'blue'
+        top_color = 'grey'
         score_name_1, score_name_2 = 'M1M3', 'M4M6'
 
         if set_num == 2:
@@ -196,52 +189,53 @@ def visualize_and_confirm_set_logic(sid, paths, set_num):
         ground_source = "Blue Patch (GND)";
         top_source = "Grey Patch (TOP)"
     else:
-        return
+        return None
 
     print(f"\n--- Processing Set: {sid} (ID {set_num}) ---")
 
     # --- CHECK 1: Ground Patch vs Mid Red Cross ---
-    ground_box_1 = find_color_in_corner(ground_img, ground_color_L, ground_color_U, target_corner_1)
-    red_box_1 = find_color_in_corner(mid_img, L_RED1, U_RED1, target_corner_1)
+    ground_box_1 = find_color_in_corner(paths['ground'], ground_color, target_corner_1)
+    red_box_1 = find_color_in_corner(paths['mid'], 'red', target_corner_1)
+
+    # --- CHECK 2: Top Patch vs Mid Red Cross ---
+    top_box_2 = find_color_in_corner(paths['top'], top_color, target_corner_2)
+    red_box_2 = find_color_in_corner(paths['mid'], 'red', target_corner_2)
+
+    score_1, score_2 = check_overlap(as_box_array([ground_box_1, top_box_2]), as_box_array([red_box_1, red_box_2])).tolist()
 
     create_pure_overlap_visualization(
-        mid_img.copy(), ground_box_1, red_box_1, target_corner_1, ground_source, score_name_1,
+        mid_img, ground_box_1, red_box_1, score_1, target_corner_1, ground_source, score_name_1,
         f"visualization_{sid}_check_{score_name_1}.png"
     )
-
-    # --- CHECK 2: Top Patch vs Mid Red Cross ---
-    top_box_2 = find_color_in_corner(top_img, top_color_L, top_color_U, target_corner_2)
-    red_box_2 = find_color_in_corner(mid_img, L_RED1, U_RED1, target_corner_2)
-
     create_pure_overlap_visualization(
-        mid_img.copy(), top_box_2, red_box_2, target_corner_2, top_source, score_name_2,
+        mid_img, top_box_2, red_box_2, score_2, target_corner_2, top_source, score_name_2,
         f"visualization_{sid}_check_{score_name_2}.png"
     )
 
+    return {'Set': sid, score_name_1: score_1, score_name_2: score_2}
 
 def run_batch_visualization(folder_path):
-    files = sorted(glob.glob(os.path.join(folder_path, "*.*")))
-    files = [f for f in files if f.lower().endswith(('.png', '.jpg'))]
-
-    groups = {}
-    for f in files:
-        sid, ftype = get_file_set_info(os.path.basename(f))
-        if sid:
-            if sid not in groups: groups[sid] = {'ground': None, 'mid': None, 'top': None}
-            groups[sid][ftype] = f
-
-    print(f"Found {len(groups)} potential image sets.")
-
-    for sid, paths in groups.items():
-        if not (paths['ground'] and paths['mid'] and paths['top']):
-            continue
-
-        try:
-            set_num = int(sid.split('_')[-1])
-        except:
-            continue
-
-        visualize_and_confirm_set_logic(sid, paths, set_num)
+    manifest = build_manifest(folder_path)
+    print(f"Found {len(manifest)} potential image sets.")
+
+    # One spawn worker per set ('spawn' avoids OpenCV's fork hangs), each capped to one OpenCV thread
+    scores = {}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=ctx,
+                             initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        futures = {}
+        for sid, paths in manifest.items():
+            if not (paths['ground'] and paths['mid'] and paths['top']) or paths['set_num'] is None:
+                continue
+
+            futures[executor.submit(visualize_and_confirm_set_logic, sid, paths, paths['set_num'])] = sid
+
+        for future in as_completed(futures):
+            result = future.result()
+            if result is not None: scores[futures[future]] = result
+
+    # Keep the folder order regardless of completion order
+    return [scores[sid] for sid in manifest if sid in scores]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import os
+import functools
+
+# Helpers shared by angle_dev.py, overlap-img-analysis.py and rotation_acc.py
+
+DILATE = True  # 3x3 dilation of the colour masks; MIN_AREA was tuned on dilated patches
+KERNEL_3x3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+
+class MaskBuffers:
+    """Reusable uint8 mask buffers keyed on ROI shape and slot."""
+
+    def __init__(self):
+        self.buf = {}
+
+    def get(self, shape, slot=0):
+        key = (shape[0], shape[1], slot)
+        if key not in self.buf:
+            self.buf[key] = np.empty(shape[:2], dtype=np.uint8)
+        return self.buf[key]
+
+
+MASKS = MaskBuffers()
+
+
+class VisCanvases:
+    """One reusable drawing canvas per image shape; write it out before the next get() on that shape."""
+
+    def __init__(self):
+        self.buf = {}
+
+    def get(self, img):
+        """Returns the canvas for img's shape, holding a fresh copy of img."""
+        if img.shape not in self.buf: self.buf[img.shape] = np.empty_like(img)
+        np.copyto(self.buf[img.shape], img)
+        return self.buf[img.shape]
+
+
+CANVASES = VisCanvases()
+
+
+@functools.lru_cache(maxsize=3)
+def load_bgr_hsv(path):
+    """Decodes an image and its HSV copy once per worker (read-only, shared by every lookup)."""
+    img = cv2.imread(path)
+    if img is None: return None, None
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    img.setflags(write=False)
+    hsv.setflags(write=False)
+    return img, hsv
+
+
+# Which half of the rows / columns each corner quadrant covers (0 = first half, 1 = second half)
+CORNER_HALVES = {'c1': (0, 1), 'c2': (1, 1), 'c3': (1, 0), 'c4': (0, 0)}
+
+
+def make_scanner(mask_fn, corner_name):
+    """Returns scan(hsv) -> (mask, x, y): the (dilated) mask_fn mask of one corner quadrant and its offset."""
+    row_half, col_half = CORNER_HALVES[corner_name]
+
+    def scan(hsv):
+        h, w = hsv.shape[:2]
+        cy, cx = h // 2, w // 2
+        y0, x0 = cy * row_half, cx * col_half
+        hsv_roi = hsv[y0:cy + (h - cy) * row_half, x0:cx + (w - cx) * col_half]
+
+        mask = mask_fn(hsv_roi, MASKS.get(hsv_roi.shape))
+        if DILATE: cv2.dilate(mask, KERNEL_3x3, dst=mask)
+        return mask, x0, y0
+
+    return scan
+
+
+def get_file_info(filename):
+    """Parses '[processed_]<set id>_<ground|mid|top>...' into (set id, plan type); ground, then mid, then top wins."""
+    base = filename.replace('processed_', '')
+    for t in ('ground', 'mid', 'top'):
+        sid, sep, _ = base.partition(f'_{t}')
+        if sep: return sid, t
+    return None, None
+
+
+def build_manifest(folder_path):
+    """Groups the folder's plans by set: {sid: {'ground': path, 'mid': path, 'top': path, 'set_num': int or None}}."""
+    manifest = {}
+    for entry in sorted(os.scandir(folder_path), key=lambda e: e.name):
+        # Hidden files include macOS '._' AppleDouble copies of the plans
+        if entry.name.startswith('.') or not entry.is_file(): continue
+        if not entry.name.lower().endswith(('.png', '.jpg')): continue
+        sid, ftype = get_file_info(entry.name)
+        if not sid: continue
+
+        if sid not in manifest:
+            try:
+                set_num = int(sid.split('_')[-1])
+            except ValueError:
+                set_num = None
+            manifest[sid] = {'ground': None, 'mid': None, 'top': None, 'set_num': set_num}
+        manifest[sid][ftype] = entry.path
+    return manifest
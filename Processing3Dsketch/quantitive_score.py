@@ -1,9 +1,184 @@
 import cv2
 import numpy as np
-import pandas as pd
 import os
-import glob
-import math
+import csv
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 1. Define Color Thresholds for the "Red/Brown X" Scribble (HSV)
+# Tuned to reliably catch dark red/maroon scribbles by using lower Saturation (S) and Value (V).
+
+# Range 1: Broadened Red near Hue=0
+LOWER_RED1 = np.array([0, 30, 30], dtype=np.uint8)
+UPPER_RED1 = np.array([20, 255, 255], dtype=np.uint8)
+
+# Range 2: Broadened Red near Hue=180
+LOWER_RED2 = np.array([160, 30, 30], dtype=np.uint8)
+UPPER_RED2 = np.array([180, 255, 255], dtype=np.uint8)
+
+MIN_SCRIBBLE_AREA = 300  # in full-resolution pixels
+DETECT_SCALE = 2  # blobs are labelled on the cleaned mask downscaled by this factor
+KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+# Per-worker mask buffers keyed by image shape; plans in a batch usually share one resolution
+_MASK_BUFFERS = {}
+
+
+def get_mask_buffers(shape):
+    """Returns the two reusable uint8 mask buffers for images of the given (height, width)."""
+    buffers = _MASK_BUFFERS.get(shape)
+    if buffers is None:
+        buffers = _MASK_BUFFERS[shape] = (np.empty(shape, np.uint8), np.empty(shape, np.uint8))
+    return buffers
+
+
+def scribble_rects(mask, labels, stats):
+    """Full-resolution (N, 4) boxes of the mask's blobs above MIN_SCRIBBLE_AREA, from its downscaled labelling."""
+    rects = []
+    # Downscaling only merges and grows blobs, so each full-resolution blob lies whole inside one small label
+    for label in (1 + np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] * DETECT_SCALE ** 2 > MIN_SCRIBBLE_AREA)).tolist():
+        x, y, w, h = (v * DETECT_SCALE for v in stats[label, :cv2.CC_STAT_AREA].tolist())
+        box = mask[y:y + h, x:x + w]
+        own = (labels[y // DETECT_SCALE:(y + h) // DETECT_SCALE, x // DETECT_SCALE:(x + w) // DETECT_SCALE] == label)
+        own = own.repeat(DETECT_SCALE, axis=0).repeat(DETECT_SCALE, axis=1)[:box.shape[0], :box.shape[1]]
+
+        # Re-label just this blob's pixels at full resolution
+        _, _, sub_stats, _ = cv2.connectedComponentsWithStats(np.where(own, box, 0).astype(np.uint8), connectivity=8)
+        sub_rects = sub_stats[1:][sub_stats[1:, cv2.CC_STAT_AREA] > MIN_SCRIBBLE_AREA, :cv2.CC_STAT_AREA]
+        rects.extend((x + bx, y + by, bw, bh) for bx, by, bw, bh in sub_rects.tolist())
+    return np.array(rects, dtype=np.int64).reshape(-1, 4)
+
+
+def process_file(file_path):
+    """Detects the scribbles on one plan, saves its visualization and returns its score row (or None)."""
+    filename = os.path.basename(file_path)
+
+    # Load the image
+    img = cv2.imread(file_path)
+
+    # CRITICAL FIX: Skip the file if it could not be loaded
+    if img is None:
+        print(f"Skipping file: {file_path}. Error: Image could not be read by OpenCV.")
+        return None
+
+    # Convert to HSV color space for stable color detection
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    # Create masks for red color and combine them (written into the reused buffers)
+    mask1, mask2 = get_mask_buffers(hsv.shape[:2])
+    cv2.inRange(hsv, LOWER_RED1, UPPER_RED1, dst=mask1)
+    cv2.inRange(hsv, LOWER_RED2, UPPER_RED2, dst=mask2)
+    mask = cv2.bitwise_or(mask1, mask2, dst=mask1)
+
+    # Clean up mask (Morphological operations)
+    cv2.morphologyEx(mask, cv2.MORPH_OPEN, KERNEL, dst=mask)
+    cv2.dilate(mask, KERNEL, dst=mask, iterations=2)
+
+    # Label on the mask downscaled by DETECT_SCALE ("any pixel set" per block, so thin strokes survive)
+    pad_y, pad_x = -mask.shape[0] % DETECT_SCALE, -mask.shape[1] % DETECT_SCALE
+    blocks = cv2.copyMakeBorder(mask, 0, pad_y, 0, pad_x, cv2.BORDER_CONSTANT, value=0) if pad_y or pad_x else mask
+    small_mask = cv2.resize(blocks, None, fx=1 / DETECT_SCALE, fy=1 / DETECT_SCALE, interpolation=cv2.INTER_AREA)
+    cv2.threshold(small_mask, 0, 255, cv2.THRESH_BINARY, dst=small_mask)
+
+    # Label the detected red areas; stats holds each blob's bounding box and pixel area (label 0 is background)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(small_mask, connectivity=8)
+
+    height, width = img.shape[:2]
+
+    # Define Corner Coordinates (based on image size)
+    corners = {
+        'c1': (width, 0),  # Top Right (TR) - (X_max, Y_min)
+        'c2': (width, height),  # Bottom Right (BR) - (X_max, Y_max)
+        'c3': (0, height),  # Bottom Left (BL) - (X_min, Y_max)
+        'c4': (0, 0)  # Top Left (TL) - (X_min, Y_min)
+    }
+
+    img_viz = img.copy()
+
+    # Bounding boxes (N, 4) of the scribble-sized blobs and their centers
+    rects = scribble_rects(mask, labels, stats)
+    centers = rects[:, :2] + rects[:, 2:] // 2
+
+    # --- NEW LOGIC: FIND CLOSEST CORNER BY DISTANCE ---
+    # Squared distance from every scribble center to every corner; sqrt doesn't change the argmin
+    corner_names = list(corners)
+    corners_arr = np.array(list(corners.values()), dtype=np.int64)
+    closest = ((centers[:, None, :] - corners_arr[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+    # Assign the detections to their closest corners
+    active_corners = {name: bool(np.any(closest == i)) for i, name in enumerate(corner_names)}
+
+    for (x, y, w, h), i in zip(rects.tolist(), closest.tolist()):
+        corner_label = f"Found {corner_names[i].upper()} "
+
+        # VISUALIZATION: Draw green box and label
+        cv2.rectangle(img_viz, (x, y), (x + w, y + h), (0, 255, 0), 5)
+        cv2.putText(img_viz, corner_label, (x, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 3)
+
+    # --- LOGIC ENGINE (Applies scores H/M based on set and file type) ---
+    row = {'filename': filename, 'H2': 0, 'H3': 0, 'H4': 0, 'H5': 0, 'M2': 0, 'M3': 0, 'M4': 0, 'M5': 0}
+
+    # Determine set_id (0, 1, 2, 3) and plan_type from filename
+    parts = filename.split('_')
+    set_id = -1
+    for part in parts:
+        if part.isdigit():
+            set_id = int(part)
+            break
+
+    plan_type = ""
+    if "ground" in filename:
+        plan_type = "ground"
+    elif "mid" in filename:
+        plan_type = "mid"
+    elif "top" in filename:
+        plan_type = "top"
+
+    # Logic for H scores (Set 0 & 1)
+    if set_id == 0:
+        if plan_type == "ground" and active_corners['c1']:
+            row['H2'] = 1
+        elif plan_type == "mid":
+            if active_corners['c2']: row['H3'] = 1
+            if active_corners['c3']: row['H4'] = 1
+        elif plan_type == "top" and active_corners['c4']:
+            row['H5'] = 1
+
+    elif set_id == 1:
+        if plan_type == "ground" and active_corners['c1']:
+            row['H2'] = 1
+        elif plan_type == "mid":
+            if active_corners['c2']: row['H3'] = 1
+            if active_corners['c4']: row['H4'] = 1
+        elif plan_type == "top" and active_corners['c3']:
+            row['H5'] = 1
+
+    # Logic for M scores (Set 2 & 3)
+    elif set_id == 2:
+        if plan_type == "ground" and active_corners['c3']:
+            row['M2'] = 1
+        elif plan_type == "mid":
+            if active_corners['c4']: row['M3'] = 1
+            if active_corners['c1']: row['M5'] = 1
+        elif plan_type == "top" and active_corners['c2']:
+            row['M4'] = 1
+
+    elif set_id == 3:
+        if plan_type == "ground" and active_corners['c3']:
+            row['M2'] = 1
+        elif plan_type == "mid":
+            if active_corners['c4']: row['M3'] = 1
+            if active_corners['c2']: row['M5'] = 1
+        elif plan_type == "top" and active_corners['c1']:
+            row['M4'] = 1
+
+    # Save image results in the directory where the script is executed
+    output_filename = f"processed_{filename}"
+    cv2.imwrite(output_filename, img_viz)
+
+    return row
 
 
 def detect_scribbles_and_score(file_paths):
@@ -13,171 +188,32 @@ def detect_scribbles_and_score(file_paths):
     using distance-based assignment to the nearest corner.
     """
 
-    results_data = []
-
-    # 1. Define Color Thresholds for the "Red/Brown X" Scribble (HSV)
-    # Tuned to reliably catch dark red/maroon scribbles by using lower Saturation (S) and Value (V).
-
-    # Range 1: Broadened Red near Hue=0
-    lower_red1 = np.array([0, 30, 30], dtype=np.uint8)
-    upper_red1 = np.array([20, 255, 255], dtype=np.uint8)
-
-    # Range 2: Broadened Red near Hue=180
-    lower_red2 = np.array([160, 30, 30], dtype=np.uint8)
-    upper_red2 = np.array([180, 255, 255], dtype=np.uint8)
-
-    MIN_SCRIBBLE_AREA = 300
-
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
-
-        # Load the image
-        img = cv2.imread(file_path)
-
-        # CRITICAL FIX: Skip the file if it could not be loaded
-        if img is None:
-            print(f"Skipping file: {file_path}. Error: Image could not be read by OpenCV.")
-            continue
-
-            # Convert to HSV color space for stable color detection
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-        # Create masks for red color and combine them
-        mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        mask = mask1 + mask2
-
-        # Clean up mask (Morphological operations)
-        kernel = np.ones((3, 3), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.dilate(mask, kernel, iterations=2)
-
-        # Find contours of the detected red areas
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        height, width = img.shape[:2]
-
-        # Define Corner Coordinates (based on image size)
-        corners = {
-            'c1': (width, 0),  # Top Right (TR) - (X_max, Y_min)
-            'c2': (width, height),  # Bottom Right (BR) - (X_max, Y_max)
-            'c3': (0, height),  # Bottom Left (BL) - (X_min, Y_max)
-            'c4': (0, 0)  # Top Left (TL) - (X_min, Y_min)
-        }
-
-        active_corners = {'c1': False, 'c2': False, 'c3': False, 'c4': False}
-        img_viz = img.copy()
-
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area > MIN_SCRIBBLE_AREA:
-                x, y, w, h = cv2.boundingRect(cnt)
-                center_x = x + w // 2
-                center_y = y + h // 2
-
-                # --- NEW LOGIC: FIND CLOSEST CORNER BY DISTANCE ---
-                min_distance = float('inf')
-                closest_corner = None
-
-                for corner_name, (cx, cy) in corners.items():
-                    # Calculate Euclidean distance from scribble center to corner
-                    distance = math.sqrt((cx - center_x) ** 2 + (cy - center_y) ** 2)
-
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_corner = corner_name
-
-                # Assign the detection to the closest corner
-                if closest_corner:
-                    active_corners[closest_corner] = True
-                    corner_label = f"Found {closest_corner.upper()} "
-                else:
-                    corner_label = "Found (Error)"
-
-                # VISUALIZATION: Draw green box and label
-                cv2.rectangle(img_viz, (x, y), (x + w, y + h), (0, 255, 0), 5)
-                cv2.putText(img_viz, corner_label, (x, y - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 3)
-
-        # --- LOGIC ENGINE (Applies scores H/M based on set and file type) ---
-        row = {'filename': filename, 'H2': 0, 'H3': 0, 'H4': 0, 'H5': 0, 'M2': 0, 'M3': 0, 'M4': 0, 'M5': 0}
-
-        # Determine set_id (0, 1, 2, 3) and plan_type from filename
-        parts = filename.split('_')
-        set_id = -1
-        for part in parts:
-            if part.isdigit():
-                set_id = int(part)
-                break
-
-        plan_type = ""
-        if "ground" in filename:
-            plan_type = "ground"
-        elif "mid" in filename:
-            plan_type = "mid"
-        elif "top" in filename:
-            plan_type = "top"
-
-        # Logic for H scores (Set 0 & 1)
-        if set_id == 0:
-            if plan_type == "ground" and active_corners['c1']:
-                row['H2'] = 1
-            elif plan_type == "mid":
-                if active_corners['c2']: row['H3'] = 1
-                if active_corners['c3']: row['H4'] = 1
-            elif plan_type == "top" and active_corners['c4']:
-                row['H5'] = 1
-
-        elif set_id == 1:
-            if plan_type == "ground" and active_corners['c1']:
-                row['H2'] = 1
-            elif plan_type == "mid":
-                if active_corners['c2']: row['H3'] = 1
-                if active_corners['c4']: row['H4'] = 1
-            elif plan_type == "top" and active_corners['c3']:
-                row['H5'] = 1
-
-        # Logic for M scores (Set 2 & 3)
-        elif set_id == 2:
-            if plan_type == "ground" and active_corners['c3']:
-                row['M2'] = 1
-            elif plan_type == "mid":
-                if active_corners['c4']: row['M3'] = 1
-                if active_corners['c1']: row['M5'] = 1
-            elif plan_type == "top" and active_corners['c2']:
-                row['M4'] = 1
-
-        elif set_id == 3:
-            if plan_type == "ground" and active_corners['c3']:
-                row['M2'] = 1
-            elif plan_type == "mid":
-                if active_corners['c4']: row['M3'] = 1
-                if active_corners['c2']: row['M5'] = 1
-            elif plan_type == "top" and active_corners['c1']:
-                row['M4'] = 1
-
-        results_data.append(row)
-
-        # Save image results in the directory where the script is executed
-        output_filename = f"processed_{filename}"
-        cv2.imwrite(output_filename, img_viz)
-
-    # Create DataFrame and Export
-    df = pd.DataFrame(results_data)
+    # One spawn worker per file ('spawn' avoids OpenCV's fork hangs), each capped to one OpenCV thread
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=ctx,
+                             initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        results_data = [row for row in executor.map(process_file, file_paths) if row is not None]
+
+    # Sort by filename and export
     final_cols = ['filename', 'H2', 'H3', 'H4', 'H5', 'M2', 'M3', 'M4', 'M5']
-    df_final = df[final_cols]
-    df_final = df_final.sort_values(by='filename').reset_index(drop=True)
+    results_data.sort(key=lambda r: r['filename'])
 
     output_csv_filename = "scribble_analysis_all.csv"
-    df_final.to_csv(output_csv_filename, index=False)
+    with open(output_csv_filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=final_cols, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(results_data)
 
     print(f"Analysis complete. Results saved to: {output_csv_filename}")
     print("\n--- Processed Files ---")
 
-    # Use to_string() to avoid the 'tabulate' dependency issue
-    print(df_final.to_string(index=False))
+    # Right-aligned table, two spaces between columns
+    table = [final_cols] + [[row[c] for c in final_cols] for row in results_data]
+    widths = [max(len(str(line[i])) for line in table) for i in range(len(final_cols))]
+    for line in table:
+        print('  '.join(str(v).rjust(n) for v, n in zip(line, widths)))
 
-    return df_final
+    return results_data
 
 
 # --- EXECUTION BLOCK ---
@@ -186,10 +222,11 @@ if __name__ == "__main__":
     # 📌 Folder to process as specified by the user
     SEARCH_PATH = "/Users/amirthavarshini/Desktop/VR-studies/testing/split_levels"
 
-    # Look for all PNG and JPG files in that folder
-    files_to_process_png = glob.glob(os.path.join(SEARCH_PATH, "*.png"))
-    files_to_process_jpg = glob.glob(os.path.join(SEARCH_PATH, "*.jpg"))
-    files_to_process = sorted(files_to_process_png + files_to_process_jpg)
+    # Look for all PNG and JPG files in that folder (one directory scan)
+    files_to_process = sorted(
+        entry.path for entry in (os.scandir(SEARCH_PATH) if os.path.isdir(SEARCH_PATH) else [])
+        if entry.is_file() and entry.name.endswith(('.png', '.jpg')) and not entry.name.startswith('.')
+    )
 
     if not files_to_process:
         print(f"Error: No PNG or JPG files found in '{SEARCH_PATH}'. Please verify the path and file extensions.")
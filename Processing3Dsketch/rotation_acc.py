@@ -1,43 +1,65 @@
 import cv2
 import numpy as np
-import os
-import glob
+import csv
+import functools
 import math
-import pandas as pd
+
+from plan_utils import build_manifest
 
 # --- CONFIGURATION ---
 # Increased tolerance to handle hand-drawn variations
 TOLERANCE = 25.0
 
+# Plans are matched with their long side capped at this many pixels
+MAX_SIDE = 1024
+ORB_FEATURES = 1000
 
-def get_file_info(filename):
-    base = filename.replace('processed_', '')
-    for t in ['ground', 'mid', 'top']:
-        if f'_{t}' in base:
-            parts = base.split(f'_{t}')
-            return parts[0], t
-    return None, None
+# FLANN with an LSH index for binary ORB descriptors, plus Lowe's ratio test
+FLANN_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+LOWE_RATIO = 0.75
 
 
-def estimate_rotation(template_path, target_path):
-    img1 = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)  # Template (Ground)
-    img2 = cv2.imread(target_path, cv2.IMREAD_GRAYSCALE)  # Target (Mid/Top)
+def detect_features(img):
+    """ORB keypoints and descriptors of a grayscale plan."""
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES, scaleFactor=1.2, nlevels=6)
+    return orb.detectAndCompute(img, None)
 
-    if img1 is None or img2 is None: return 0.0
+
+@functools.lru_cache(maxsize=128)
+def load_template(template_path):
+    """Decodes a ground plan once per path and returns (shape, keypoints, descriptors), or None."""
+    img1 = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)  # Template (Ground)
+    if img1 is None: return None
 
     h, w = img1.shape
-    img2 = cv2.resize(img2, (w, h))
+    if max(h, w) > MAX_SIDE:
+        s = MAX_SIDE / max(h, w)
+        img1 = cv2.resize(img1, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+
+    kp1, des1 = detect_features(img1)
+    return img1.shape, kp1, des1
+
+
+def estimate_rotation(template, target_path):
+    if template is None: return 0.0
+    (h, w), kp1, des1 = template
+
+    img2 = cv2.imread(target_path, cv2.IMREAD_GRAYSCALE)  # Target (Mid/Top)
+    if img2 is None: return 0.0
+
+    # Bring the target onto the (possibly downscaled) template grid
+    img2 = cv2.resize(img2, (w, h), interpolation=cv2.INTER_AREA)
 
     # ORB Feature Detector
-    orb = cv2.ORB_create(nfeatures=5000)
-    kp1, des1 = orb.detectAndCompute(img1, None)
-    kp2, des2 = orb.detectAndCompute(img2, None)
+    kp2, des2 = detect_features(img2)
 
     if des1 is None or des2 is None or len(des1) < 10 or len(des2) < 10: return 0.0
 
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    flann = cv2.FlannBasedMatcher(FLANN_LSH_PARAMS, {})
     try:
-        matches = bf.match(des1, des2)
+        # LSH can return fewer than two neighbours for a descriptor; those can't pass the ratio test
+        knn = flann.knnMatch(des1, des2, k=2)
+        matches = [p[0] for p in knn if len(p) == 2 and p[0].distance < LOWE_RATIO * p[1].distance]
         if len(matches) < 10: return 0.0
 
         src_pts = np.float32([kp1[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
@@ -75,15 +97,7 @@ def check_angle_match_debug(angle, target, tolerance):
 
 
 def run_rotation_audit(folder_path):
-    files = sorted(glob.glob(os.path.join(folder_path, "*.*")))
-    files = [f for f in files if f.lower().endswith(('.png', '.jpg'))]
-
-    groups = {}
-    for f in files:
-        sid, ftype = get_file_info(os.path.basename(f))
-        if sid:
-            if sid not in groups: groups[sid] = {'ground': None, 'mid': None, 'top': None}
-            groups[sid][ftype] = f
+    groups = build_manifest(folder_path)
 
     print(f"Found {len(groups)} sets. analyzing with tolerance +/- {TOLERANCE} degrees...")
     results = []
@@ -92,12 +106,15 @@ def run_rotation_audit(folder_path):
         if not (paths['ground'] and paths['mid'] and paths['top']):
             continue
 
+        # Ground features are shared by both comparisons
+        template = load_template(paths['ground'])
+
         # 1. Mid vs Ground (Target: 90 or 270)
-        angle_mid = estimate_rotation(paths['ground'], paths['mid'])
+        angle_mid = estimate_rotation(template, paths['mid'])
         score_mid, dev_mid = check_angle_match_debug(angle_mid, 90, TOLERANCE)
 
         # 2. Top vs Ground (Target: 180)
-        angle_top = estimate_rotation(paths['ground'], paths['top'])
+        angle_top = estimate_rotation(template, paths['top'])
         score_top, dev_top = check_angle_match_debug(angle_top, 180, TOLERANCE)
 
         print(f"Set {sid}:")
@@ -115,9 +132,11 @@ def run_rotation_audit(folder_path):
         })
 
     if results:
-        df = pd.DataFrame(results)
         csv_name = "rotation_audit_debug.csv"
-        df.to_csv(csv_name, index=False)
+        with open(csv_name, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]), lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(results)
         print(f"\nSaved detailed report to {csv_name}")
 
 